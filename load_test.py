@@ -0,0 +1,397 @@
+# ===========================================
+# load_test.py
+# 週案アプリの負荷試験（ヘッドレス・1 台の Linux で完結）
+# ・Streamlit の AppTest で weekly_plan_app.py を直接動かす
+# ・教員セッション：時間割を何コマか入力して提出
+# ・管理職セッション：提出済みの週案を承認／差戻
+# ・教員・管理職をワーカープロセスで同時に走らせる
+#   （AppTest はプロセス内で状態を共有するため、同時セッションはプロセスを分ける）
+# ・ワーカーを --cpus 個の CPU に固定し、1 サーバープロセス相当の CPU 予算で試験する
+# ・再実行（rerun）時間の p50／p95、DB 書き込みロック待ち、処理件数／秒を集計
+#
+# 使い方：
+#   python load_test.py --teachers 60 --managers 2 --ramp 60
+# 既定では一時ディレクトリに新しい DB を作って試験する（本番 DB は触らない）。
+# ===========================================
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "weekly_plan_app.py")
+sys.path.insert(0, APP_DIR)
+
+from weekly_plan_core import DB_PATH, STANDARD_HOURS, WEEK_SLOTS, get_subjects_for_grade  # noqa: E402
+
+LOAD_TEST_PASSWORD = "load-test"
+SCRIPT_TIMEOUT = 120
+
+
+# ------------------------------
+# 計測結果の記録（セッションごとに作り、親プロセスで合算）
+# ------------------------------
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.completed = {}
+        self.lock_waits = []
+
+    def timed_run(self, action: str, at: AppTest):
+        start = time.perf_counter()
+        at.run(timeout=SCRIPT_TIMEOUT)
+        self.latencies.setdefault(action, []).append(time.perf_counter() - start)
+        if at.exception:
+            self.error(action, at.exception[0].message)
+        return at
+
+    def error(self, action: str, message: str):
+        key = f"{action}: {message.splitlines()[0][:80]}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def done(self, action: str):
+        self.completed[action] = self.completed.get(action, 0) + 1
+
+    def merge(self, other: "Recorder"):
+        for action, values in other.latencies.items():
+            self.latencies.setdefault(action, []).extend(values)
+        for key, n in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + n
+        for key, n in other.completed.items():
+            self.completed[key] = self.completed.get(key, 0) + n
+        self.lock_waits.extend(other.lock_waits)
+
+
+def init_worker(cpus):
+    """ワーカープロセスを指定 CPU に固定する（Linux のみ）。"""
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def new_session(role: str) -> AppTest:
+    at = AppTest.from_file(APP_PATH, default_timeout=SCRIPT_TIMEOUT)
+    at.secrets["ADMIN_PASSWORD"] = LOAD_TEST_PASSWORD
+    if role == "管理職":
+        # ログインフォームは試験対象外なので認証済みの状態から始める
+        at.session_state["manager_authenticated"] = True
+    return at
+
+
+def warm_up():
+    new_session("教員").run(timeout=SCRIPT_TIMEOUT)
+
+
+# ------------------------------
+# 教員セッション
+# ------------------------------
+def teacher_session(n: int, start_at: float, args) -> Recorder:
+    rec = Recorder()
+    rng = random.Random(args.seed + n)
+    grade = rng.choice(list(STANDARD_HOURS.keys()))
+    klass = f"{grade[0]}-{n % 4 + 1}"
+    subjects = get_subjects_for_grade(grade)
+    time.sleep(max(0.0, start_at - time.time()))
+
+    try:
+        at = rec.timed_run("教員：初回表示", new_session("教員"))
+        at.text_input[0].input(f"負荷試験教員{n:03d}")
+        at.text_input[1].input(klass)
+        [sb for sb in at.selectbox if sb.label == "基準学年"][0].select(grade)
+        at.date_input[0].set_value(args.week)
+        rec.timed_run("教員：入力", at)
+
+        for day, period in rng.sample(WEEK_SLOTS, min(args.edits, len(WEEK_SLOTS))):
+            at.selectbox(key=f"{day}_{period}_subject").select(rng.choice(subjects))
+            at.text_area(key=f"{day}_{period}_content").input("負荷試験")
+            rec.timed_run("教員：入力", at)
+
+        submit = [b for b in at.button if "提出" in b.label][0]
+        submit.click()
+        rec.timed_run("教員：提出", at)
+        if at.success:
+            rec.done("提出")
+    except Exception as e:
+        rec.error("教員", f"{type(e).__name__}: {e}")
+    return rec
+
+
+# ------------------------------
+# 管理職セッション
+# ------------------------------
+def outcome_message(at: AppTest) -> str:
+    """承認／差戻が受け付けられなかったときに画面へ出た文言（警告・案内）。"""
+    if at.exception:
+        # 例外の内容は timed_run で記録済み
+        return "例外により未処理"
+    for elements in (at.warning, at.info):
+        if elements:
+            return elements[0].value
+    return "結果の表示なし"
+
+
+def manager_session(idx: int, args, teachers_done) -> Recorder:
+    rec = Recorder()
+    rng = random.Random(args.seed * 1000 + idx)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    # 一覧を読み直しても操作できなかった週案は、再度選ばないようにする
+    skipped = set()
+    try:
+        at = rec.timed_run("管理職：一覧表示", new_session("管理職"))
+        at.sidebar.selectbox[0].select("管理職")
+        rec.timed_run("管理職：一覧表示", at)
+    except Exception as e:
+        rec.error("管理職：一覧表示", f"{type(e).__name__}: {e}")
+        conn.close()
+        return rec
+
+    try:
+        while True:
+            # 管理職同士で同じ週案を扱わないよう、ID で担当を分ける
+            pending = [
+                r[0]
+                for r in conn.execute("SELECT id FROM weekly_plans WHERE status='提出' ORDER BY id")
+                if r[0] % args.managers == idx and r[0] not in skipped
+            ]
+            if not pending:
+                if teachers_done.is_set():
+                    break
+                time.sleep(args.think)
+                try:
+                    rec.timed_run("管理職：一覧表示", at)
+                except Exception as e:
+                    rec.error("管理職：一覧表示", f"{type(e).__name__}: {e}")
+                continue
+
+            wid = pending[0]
+            # 1 件の失敗でセッション全体を終わらせず、記録して次へ進む
+            try:
+                manager_review(rec, at, wid, rng.random() < args.reject_rate)
+            except Exception as e:
+                rec.error("管理職", f"{type(e).__name__}: {e}")
+                skipped.add(wid)
+            time.sleep(args.think)
+    finally:
+        conn.close()
+    return rec
+
+
+def manager_review(rec: Recorder, at: AppTest, wid: int, reject: bool):
+    """1 件の週案を承認または差戻す。ボタンが見つからなければ LookupError を送出する。"""
+    if f"approve_{wid}" not in {b.key for b in at.button}:
+        # 前回の表示より後に提出された週案は、一覧を読み直してから操作する
+        rec.timed_run("管理職：一覧表示", at)
+        if f"approve_{wid}" not in {b.key for b in at.button}:
+            raise LookupError(f"週案 {wid} のボタンが一覧にありません")
+    if reject:
+        at.button(key=f"reject_{wid}").click()
+        rec.timed_run("管理職：差戻", at)
+        if any("差戻にしました" in w.value for w in at.warning):
+            rec.done("差戻")
+        else:
+            rec.error("管理職：差戻", outcome_message(at))
+    else:
+        at.button(key=f"approve_{wid}").click()
+        rec.timed_run("管理職：承認", at)
+        if any("承認しました" in m.value for m in at.success):
+            rec.done("承認")
+        else:
+            rec.error("管理職：承認", outcome_message(at))
+
+
+# ------------------------------
+# DB 書き込みロック待ちの計測
+# ------------------------------
+def lock_probe(rec: Recorder, stop: threading.Event, interval: float):
+    """別接続で短い書き込みトランザクションを取り、ロック獲得までの待ち時間を記録する。"""
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                waited = time.perf_counter() - start
+                conn.execute("COMMIT")
+                rec.lock_waits.append(waited)
+            except sqlite3.OperationalError as e:
+                rec.error("ロック計測", str(e))
+            stop.wait(interval)
+    finally:
+        conn.close()
+
+
+# ------------------------------
+# 集計・表示
+# ------------------------------
+def build_report(rec: Recorder, wall: float, args) -> dict:
+    reruns = {}
+    for action, values in sorted(rec.latencies.items()):
+        reruns[action] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values),
+        }
+    all_reruns = [v for values in rec.latencies.values() for v in values]
+    return {
+        "teachers": args.teachers,
+        "managers": args.managers,
+        "workers": args.workers,
+        "cpus": args.cpus,
+        "wall_seconds": wall,
+        "reruns": reruns,
+        "reruns_total": {
+            "count": len(all_reruns),
+            "p50": percentile(all_reruns, 50),
+            "p95": percentile(all_reruns, 95),
+            "per_second": len(all_reruns) / wall if wall else 0.0,
+        },
+        "lock_wait": {
+            "samples": len(rec.lock_waits),
+            "p50": percentile(rec.lock_waits, 50),
+            "p95": percentile(rec.lock_waits, 95),
+            "max": max(rec.lock_waits, default=0.0),
+            "over_100ms": sum(1 for w in rec.lock_waits if w > 0.1),
+        },
+        "completed": dict(rec.completed),
+        "throughput_per_minute": {
+            k: v * 60 / wall for k, v in rec.completed.items()
+        } if wall else {},
+        "errors": dict(rec.errors),
+    }
+
+
+def print_report(report: dict):
+    print(f"\n=== 負荷試験結果（教員 {report['teachers']} 名／管理職 {report['managers']} 名）===")
+    print(f"同時実行：教員 {report['workers']} セッション／CPU {report['cpus'] or '制限なし'}")
+    print(f"所要時間：{report['wall_seconds']:.1f} 秒")
+    print("\n再実行時間（秒）")
+    print(f"  {'操作':<16}{'回数':>6}{'p50':>9}{'p95':>9}{'最大':>9}")
+    for action, r in report["reruns"].items():
+        print(f"  {action:<16}{r['count']:>6}{r['p50']:>9.3f}{r['p95']:>9.3f}{r['max']:>9.3f}")
+    t = report["reruns_total"]
+    print(f"  {'（全体）':<16}{t['count']:>6}{t['p50']:>9.3f}{t['p95']:>9.3f}")
+    print(f"  再実行スループット：{t['per_second']:.2f} 回／秒")
+
+    lw = report["lock_wait"]
+    print("\nDB 書き込みロック待ち（秒）")
+    print(
+        f"  計測 {lw['samples']} 回  p50 {lw['p50']:.4f}  p95 {lw['p95']:.4f}  "
+        f"最大 {lw['max']:.4f}  100ms超 {lw['over_100ms']} 回"
+    )
+
+    print("\n処理件数")
+    for k, v in report["completed"].items():
+        print(f"  {k}：{v} 件（{report['throughput_per_minute'][k]:.1f} 件／分）")
+
+    if report["errors"]:
+        print("\nエラー")
+        for k, v in report["errors"].items():
+            print(f"  {v} 回  {k}")
+    else:
+        print("\nエラーなし")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="週案アプリの負荷試験（AppTest による同時実行）")
+    parser.add_argument("--teachers", type=int, default=60, help="同時に提出する教員数")
+    parser.add_argument("--managers", type=int, default=2, help="同時に承認する管理職数")
+    parser.add_argument("--ramp", type=float, default=60.0, help="教員の開始をばらけさせる秒数")
+    parser.add_argument("--edits", type=int, default=5, help="教員 1 人あたりの入力コマ数")
+    parser.add_argument("--reject-rate", type=float, default=0.2, help="差戻にする割合")
+    parser.add_argument("--think", type=float, default=0.5, help="管理職の操作間隔（秒）")
+    parser.add_argument("--probe-interval", type=float, default=0.2, help="ロック待ち計測の間隔（秒）")
+    parser.add_argument("--workers", type=int, default=8, help="同時に動かす教員セッション数")
+    parser.add_argument("--cpus", type=int, default=1, help="ワーカーに使わせる CPU 数（0 で制限なし）")
+    parser.add_argument("--week", type=date.fromisoformat, default=date.today() - timedelta(days=date.today().weekday()))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workdir", help="DB を置くディレクトリ（既定：一時ディレクトリ）")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args(argv)
+    args.managers = max(args.managers, 1)
+    args.workers = max(min(args.workers, args.teachers), 1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="weekly_plan_load_")
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    print(f"作業ディレクトリ：{workdir}")
+
+    cpus = set(sorted(os.sched_getaffinity(0))[: args.cpus]) if args.cpus else None
+    ctx = multiprocessing.get_context("spawn")
+    rec = Recorder()
+    stop_probe = threading.Event()
+    probe_rec = Recorder()
+    probe = threading.Thread(
+        target=lock_probe, args=(probe_rec, stop_probe, args.probe_interval), daemon=True
+    )
+
+    with ctx.Manager() as mp_manager:
+        teachers_done = mp_manager.Event()
+        with ProcessPoolExecutor(
+            max_workers=args.managers, mp_context=ctx, initializer=init_worker, initargs=(cpus,)
+        ) as manager_pool, ProcessPoolExecutor(
+            max_workers=args.workers, mp_context=ctx, initializer=init_worker, initargs=(cpus,)
+        ) as teacher_pool:
+            # スキーマを作っておく（全セッションが同時に CREATE しないように）。
+            # 親プロセスで AppTest を動かすと __main__ が画面スクリプトに置き換わり、
+            # 以後 spawn するプロセスで画面が再実行されるため、ワーカー側で行う。
+            teacher_pool.submit(warm_up).result()
+
+            start = time.perf_counter()
+            start_epoch = time.time()
+            probe.start()
+            managers = [
+                manager_pool.submit(manager_session, i, args, teachers_done)
+                for i in range(args.managers)
+            ]
+            teachers = [
+                teacher_pool.submit(teacher_session, n, start_epoch + args.ramp * n / args.teachers, args)
+                for n in range(args.teachers)
+            ]
+            for f in teachers:
+                rec.merge(f.result())
+            teachers_done.set()
+            for f in managers:
+                rec.merge(f.result())
+            wall = time.perf_counter() - start
+    stop_probe.set()
+    probe.join()
+    rec.merge(probe_rec)
+
+    report = build_report(rec, wall, args)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    # ワーカーに渡す関数は __main__ ではなく load_test モジュールとして参照させる
+    # （AppTest を動かしたワーカーでは __main__ が画面スクリプトに置き換わるため）
+    import load_test
+
+    sys.exit(load_test.main())
@@ -14,7 +14,41 @@ import streamlit as st
 import sqlite3
 from datetime import date
 import json
-import pandas as pd
+import os
+
+from weekly_plan_core import (
+    ALL_SUBJECTS,
+    DAYS,
+    DB_PATH,
+    PERIOD_MINUTES,
+    PERIODS,
+    STANDARD_HOURS,
+    behind_pace_subjects,
+    build_print_df,
+    build_slot_matrix,
+    cached_print_df,
+    compute_week_subject_minutes,
+    convert_to_45,
+    get_subjects_for_grade,
+    print_title,
+    render_print_html,
+    school_year_progress,
+    school_year_start,
+    slot_matrix_styles,
+    total_week_minutes,
+)
+from weekly_plan_jobs import (
+    ACTIVE_STATUSES,
+    APPROVED,
+    HOURS_LOCKED,
+    JOB_LABELS,
+    JOB_STATUS_LABELS,
+    JobLockedError,
+    JobStartError,
+    JobRunner,
+    approve_plan,
+    list_jobs,
+)
 
 # ------------------------------
 # 管理職用パスワード
@@ -87,7 +121,6 @@ COLUMN_WIDTHS = [0.7] + [1.6] * 6
 # ------------------------------
 # データベース
 # ------------------------------
-DB_PATH = "weekly_plans.db"
 conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 cur = conn.cursor()
 
@@ -128,271 +161,342 @@ CREATE TABLE IF NOT EXISTS hours_total (
 )
 """
 )
-conn.commit()
 
-# ------------------------------
-# 学年ごとの標準時数（45分換算コマ数）
-# ------------------------------
-STANDARD_HOURS = {
-    "1年": {
-        "国語": 306,
-        "算数": 140,
-        "生活": 102,
-        "音楽": 68,
-        "図工": 68,
-        "体育": 102,
-        "道徳": 34,
-        "特活": 34,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-    "2年": {
-        "国語": 280,
-        "算数": 140,
-        "生活": 102,
-        "音楽": 68,
-        "図工": 68,
-        "体育": 102,
-        "道徳": 35,
-        "特活": 35,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-    "3年": {
-        "国語": 210,
-        "社会": 70,
-        "算数": 175,
-        "理科": 70,
-        "音楽": 50,
-        "図工": 50,
-        "体育": 105,
-        "道徳": 35,
-        "特活": 35,
-        "外国語活動": 35,
-        "総合的な学習の時間": 70,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-    "4年": {
-        "国語": 175,
-        "社会": 105,
-        "算数": 175,
-        "理科": 105,
-        "音楽": 50,
-        "図工": 50,
-        "体育": 105,
-        "道徳": 35,
-        "特活": 35,
-        "外国語活動": 35,
-        "総合的な学習の時間": 70,
-        "家庭科": 0,
-        "クラブ": 10,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-    "5年": {
-        "国語": 175,
-        "社会": 105,
-        "算数": 175,
-        "理科": 105,
-        "音楽": 45,
-        "図工": 45,
-        "家庭科": 70,
-        "体育": 90,
-        "道徳": 35,
-        "特活": 35,
-        "外国語": 70,
-        "総合的な学習の時間": 70,
-        "クラブ": 10,
-        "委員会": 10,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-    "6年": {
-        "国語": 175,
-        "社会": 105,
-        "算数": 140,
-        "理科": 105,
-        "音楽": 45,
-        "図工": 45,
-        "家庭科": 70,
-        "体育": 90,
-        "道徳": 35,
-        "特活": 35,
-        "外国語": 70,
-        "総合的な学習の時間": 70,
-        "クラブ": 10,
-        "委員会": 10,
-        "学校行事": 0,
-        "読書科": 70,
-        "学校裁量（学力向上）": 35,
-        "学校裁量（探究）": 35,
-    },
-}
-
-
-def get_subjects_for_grade(grade: str):
-    return list(STANDARD_HOURS[grade].keys())
-
-
-# 専科用：全学年の教科リスト（重複なし）
-ALL_SUBJECTS = sorted(
-    {subj for g in STANDARD_HOURS.values() for subj in g.keys()}
+# 変更履歴テーブル（管理職画面の自動更新用）
+# 週案の提出・状態変更、年間累積時数の更新をトリガーで連番記録する。
+cur.execute(
+    """
+CREATE TABLE IF NOT EXISTS plan_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT,
+    plan_id INTEGER,
+    grade TEXT,
+    subject TEXT,
+    changed_at TEXT
 )
+"""
+)
+cur.execute(
+    """
+CREATE TRIGGER IF NOT EXISTS trg_weekly_plans_insert
+AFTER INSERT ON weekly_plans
+BEGIN
+    INSERT INTO plan_changes (kind, plan_id, grade, changed_at)
+    VALUES ('submit', NEW.id, NEW.grade, DATETIME('now'));
+END
+"""
+)
+cur.execute(
+    """
+CREATE TRIGGER IF NOT EXISTS trg_weekly_plans_status
+AFTER UPDATE OF status ON weekly_plans
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO plan_changes (kind, plan_id, grade, changed_at)
+    VALUES ('status', NEW.id, NEW.grade, DATETIME('now'));
+END
+"""
+)
+cur.execute(
+    """
+CREATE TRIGGER IF NOT EXISTS trg_hours_total_insert
+AFTER INSERT ON hours_total
+BEGIN
+    INSERT INTO plan_changes (kind, grade, subject, changed_at)
+    VALUES ('hours', NEW.grade, NEW.subject, DATETIME('now'));
+END
+"""
+)
+cur.execute(
+    """
+CREATE TRIGGER IF NOT EXISTS trg_hours_total_update
+AFTER UPDATE ON hours_total
+BEGIN
+    INSERT INTO plan_changes (kind, grade, subject, changed_at)
+    VALUES ('hours', NEW.grade, NEW.subject, DATETIME('now'));
+END
+"""
+)
+conn.commit()
 
 # ------------------------------
-# 時間割の枠組み
+# 一括処理のジョブランナー（サーバープロセスで共有）
 # ------------------------------
-DAYS = ["月", "火", "水", "木", "金", "土"]
-PERIODS = ["1校時", "2校時", "3校時", "4校時", "5校時", "学校裁量", "6校時"]
+JOB_POLL_SECONDS = 2
+
+
+@st.cache_resource(on_release=lambda runner: runner.shutdown())
+def get_job_runner() -> JobRunner:
+    return JobRunner(DB_PATH)
 
-PERIOD_MINUTES = {}
-for day in DAYS:
-    PERIOD_MINUTES[day] = {}
-    for period in PERIODS:
-        if period == "学校裁量":
-            PERIOD_MINUTES[day][period] = 45 if day in ["月", "火", "木", "金"] else 0
-        else:
-            num = int(period[0])
-            PERIOD_MINUTES[day][period] = 40 if num <= 5 else 45
 
 # ------------------------------
-# 分 → 45分コマ換算
+# 状態ラベル（HTML）
 # ------------------------------
-def convert_to_45(mins: float) -> float:
-    return mins / 45
+def status_badge(status: str) -> str:
+    cls = "status-teishutsu"
+    if status == "承認":
+        cls = "status-shonin"
+    elif status == "差戻":
+        cls = "status-sashimodoshi"
+    return f'<span class="status-label {cls}">{status}</span>'
 
 
 # ------------------------------
-# 年間累積時数を加算
+# 管理職画面の自動更新（変更履歴のポーリング）
 # ------------------------------
-def add_hours(grade: str, subject: str, minutes: float):
-    add_45 = convert_to_45(minutes)
+# 一覧全体を読み直さず、plan_changes の連番だけを短い間隔で確認する。
+# 新しい変更があったときだけ、状態別件数・新着行・該当教科の累積時数を更新する。
+DASHBOARD_POLL_SECONDS = 10
+
+
+def fetch_latest_change_seq() -> int:
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM plan_changes")
+    return cur.fetchone()[0]
+
+
+def fetch_status_counts() -> dict:
+    counts = {"提出": 0, "承認": 0, "差戻": 0}
+    cur.execute("SELECT status, COUNT(*) FROM weekly_plans GROUP BY status")
+    for stt, n in cur.fetchall():
+        if stt in counts:
+            counts[stt] = n
+    return counts
+
+
+def fetch_changes_since(seq: int):
     cur.execute(
-        "SELECT consumed FROM hours_total WHERE grade=? AND subject=?",
-        (grade, subject),
+        """
+        SELECT seq, kind, plan_id, grade, subject
+        FROM plan_changes
+        WHERE seq > ?
+        ORDER BY seq
+        """,
+        (seq,),
     )
-    row = cur.fetchone()
-    if row:
-        new_value = row[0] + add_45
-        cur.execute(
-            "UPDATE hours_total SET consumed=? WHERE grade=? AND subject=?",
-            (new_value, grade, subject),
-        )
-    else:
+    return cur.fetchall()
+
+
+def fetch_plan_summaries(plan_ids):
+    """plan_json を除いた一覧表示用の列だけを取得する。"""
+    if not plan_ids:
+        return []
+    placeholders = ",".join("?" for _ in plan_ids)
+    cur.execute(
+        f"""
+        SELECT id, week, grade, class, teacher, status, submitted_at
+        FROM weekly_plans
+        WHERE id IN ({placeholders})
+        """,
+        list(plan_ids),
+    )
+    return cur.fetchall()
+
+
+def fetch_hours_consumed(pairs) -> dict:
+    result = {}
+    for g, subj in pairs:
         cur.execute(
-            "INSERT INTO hours_total (grade, subject, consumed) VALUES (?, ?, ?)",
-            (grade, subject, add_45),
+            "SELECT consumed FROM hours_total WHERE grade=? AND subject=?",
+            (g, subj),
         )
-    conn.commit()
+        row = cur.fetchone()
+        result[(g, subj)] = row[0] if row else 0.0
+    return result
 
 
-# ------------------------------
-# 学級名から学年を推定（例：3-1 → 3年）
-# ------------------------------
-def detect_grade_from_class(klass: str):
-    if not klass:
-        return None
-    for ch in klass:
-        if ch.isdigit():
-            g = f"{ch}年"
-            return g if g in STANDARD_HOURS else None
-    return None
+def init_dashboard_state():
+    if "dashboard_seen_seq" in st.session_state:
+        return
+    seq = fetch_latest_change_seq()
+    st.session_state["dashboard_seen_seq"] = seq
+    st.session_state["dashboard_counts"] = fetch_status_counts()
+    st.session_state["dashboard_new_rows"] = {}
+    st.session_state["dashboard_hours"] = {}
+
+
+def refresh_dashboard_state() -> bool:
+    """新しい変更があれば取り込み、取り込んだ場合は True を返す。"""
+    seen = st.session_state["dashboard_seen_seq"]
+    if fetch_latest_change_seq() <= seen:
+        return False
+
+    changes = fetch_changes_since(seen)
+    plan_ids = set()
+    hour_pairs = set()
+    for seq, kind, plan_id, g, subj in changes:
+        if kind in ("submit", "status") and plan_id is not None:
+            plan_ids.add(plan_id)
+        elif kind == "hours":
+            hour_pairs.add((g, subj))
+        seen = seq
+
+    if plan_ids:
+        st.session_state["dashboard_counts"] = fetch_status_counts()
+        new_rows = st.session_state["dashboard_new_rows"]
+        for wid, week, g, klass, teacher, status, submitted_at in fetch_plan_summaries(plan_ids):
+            new_rows[wid] = {
+                "ID": wid,
+                "週": week,
+                "学年": g,
+                "学級": klass,
+                "教員": teacher,
+                "状態": status,
+                "提出日時": submitted_at,
+            }
+    if hour_pairs:
+        st.session_state["dashboard_hours"].update(fetch_hours_consumed(hour_pairs))
+
+    st.session_state["dashboard_seen_seq"] = seen
+    return True
+
+
+@st.fragment(run_every=DASHBOARD_POLL_SECONDS)
+def live_dashboard():
+    refresh_dashboard_state()
+    counts = st.session_state["dashboard_counts"]
+
+    st.markdown("#### 状態別件数")
+    st.write(f"- 提出：{counts['提出']} 件")
+    st.write(f"- 承認：{counts['承認']} 件")
+    st.write(f"- 差戻：{counts['差戻']} 件")
+    st.caption(f"※ {DASHBOARD_POLL_SECONDS} 秒ごとに自動で確認しています。")
+
+    new_rows = st.session_state["dashboard_new_rows"]
+    if new_rows:
+        st.markdown("#### 🆕 この画面を開いてからの提出・状態変更")
+        st.table(sorted(new_rows.values(), key=lambda r: r["ID"], reverse=True))
+        if st.button("一覧を最新の状態に更新する", key="dashboard_reload"):
+            st.session_state["dashboard_new_rows"] = {}
+            st.session_state["dashboard_hours"] = {}
+            st.rerun(scope="app")
+
+    hours = st.session_state["dashboard_hours"]
+    if hours:
+        st.markdown("#### 更新された年間累積時数（45分コマ換算）")
+        rows_table = []
+        for (g, subj), used in sorted(hours.items()):
+            std = STANDARD_HOURS.get(g, {}).get(subj, 0)
+            rows_table.append(
+                {
+                    "学年": g,
+                    "教科等": subj,
+                    "標準（45分コマ）": std,
+                    "実施累積（45分コマ）": round(used, 1),
+                    "残り（45分コマ）": round(std - used, 1),
+                }
+            )
+        st.table(rows_table)
 
 
 # ------------------------------
-# 1週間分のコマを学年×教科ごとに分数集計
+# 一括処理の進捗表示
 # ------------------------------
-def compute_week_subject_minutes(timetable: dict, base_grade: str):
-    """
-    戻り値: { "3年": { "国語": 分数, ... }, "4年": {...}, ... }
-    学級が判別できる場合はそちらを優先し、
-    判別できない場合は base_grade でカウント。
-    """
-    result = {}
-    for day in DAYS:
-        for period in PERIODS:
-            cell = timetable.get(day, {}).get(period)
-            if not cell:
-                continue
-            minutes = PERIOD_MINUTES[day][period]
-            if minutes <= 0:
-                continue
-            subject = cell.get("subject", "")
-            klass = cell.get("class", "")
-            grade_for_slot = detect_grade_from_class(klass) or base_grade
-            if grade_for_slot not in STANDARD_HOURS:
-                continue
-            # その学年でカウント対象の教科だけ集計
-            if subject not in STANDARD_HOURS[grade_for_slot]:
-                continue
-            result.setdefault(grade_for_slot, {})
-            result[grade_for_slot][subject] = (
-                result[grade_for_slot].get(subject, 0) + minutes
+# 実行中のジョブがあるときだけ短い間隔で進捗を確認し、
+# 完了済みジョブは通常の再実行時だけ表示する（結果ファイルはダウンロード時に読む）。
+JOB_RESULT_MIME = {".csv": "text/csv", ".html": "text/html"}
+
+
+def read_result_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def job_header(job: dict):
+    label = JOB_LABELS.get(job["kind"], job["kind"])
+    status_label = JOB_STATUS_LABELS.get(job["status"], job["status"])
+    st.write(f"**ID:{job['id']} {label}** ／ {status_label} ／ 依頼：{job['created_at']}")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def active_job_monitor():
+    jobs = [j for j in list_jobs(conn, limit=10) if j["status"] in ACTIVE_STATUSES]
+    if not jobs:
+        # すべて終わったら画面全体を更新して結果を表示し、ポーリングをやめる
+        st.rerun(scope="app")
+    runner = get_job_runner()
+    for job in jobs:
+        job_header(job)
+        total = job["progress_total"] or 0
+        done = job["progress_done"] or 0
+        st.progress(done / total if total else 0.0, text=job["message"] or "")
+        if job["cancel_requested"]:
+            st.caption("中止を要求しました。区切りのよいところで停止します。")
+        elif st.button("中止する", key=f"cancel_job_{job['id']}"):
+            runner.cancel(job["id"])
+            st.rerun(scope="fragment")
+
+
+def job_monitor():
+    jobs = list_jobs(conn, limit=10)
+    if not jobs:
+        st.caption("実行履歴はまだありません。")
+        return
+    if any(j["status"] in ACTIVE_STATUSES for j in jobs):
+        active_job_monitor()
+    for job in jobs:
+        if job["status"] in ACTIVE_STATUSES:
+            continue
+        job_header(job)
+        path = job["result_path"]
+        if job["status"] == "done" and path and os.path.exists(path):
+            st.download_button(
+                "結果をダウンロード",
+                lambda path=path: read_result_file(path),
+                file_name=os.path.basename(path),
+                mime=JOB_RESULT_MIME.get(os.path.splitext(path)[1]),
+                key=f"download_job_{job['id']}",
             )
-    return result
+        elif job["message"]:
+            st.caption(job["message"])
 
 
-# ------------------------------
-# 状態ラベル（HTML）
-# ------------------------------
-def status_badge(status: str) -> str:
-    cls = "status-teishutsu"
-    if status == "承認":
-        cls = "status-shonin"
-    elif status == "差戻":
-        cls = "status-sashimodoshi"
-    return f'<span class="status-label {cls}">{status}</span>'
+def submit_job(kind: str, params: dict = None):
+    try:
+        job_id = get_job_runner().submit(kind, params)
+    except JobLockedError:
+        st.warning("年間累積時数を更新する別の処理が実行中です。完了してから実行してください。")
+    except JobStartError as e:
+        st.error(f"「{JOB_LABELS[kind]}」を開始できませんでした（ジョブID:{e.args[0]}）。もう一度実行してください。")
+    else:
+        st.success(f"「{JOB_LABELS[kind]}」を受け付けました（ジョブID:{job_id}）。")
 
 
 # ------------------------------
-# 印刷用 DataFrame を生成
+# 週ごとのコマ配置状況（全学級）
 # ------------------------------
-def build_print_df(timetable: dict) -> pd.DataFrame:
-    rows = []
-    index = []
-    for period in PERIODS:
-        if not any(PERIOD_MINUTES[day][period] > 0 for day in DAYS):
-            continue
-        row = []
-        for day in DAYS:
-            mins = PERIOD_MINUTES[day][period]
-            if mins <= 0:
-                row.append("")
-                continue
-            cell = timetable.get(day, {}).get(period, {})
-            klass = cell.get("class", "")
-            subj = cell.get("subject", "")
-            cont = cell.get("content", "")
-
-            text = ""
-            if klass:
-                text += f"{klass} "
-            if subj and subj != "（空欄）":
-                text += subj
-            if cont:
-                if text:
-                    text += "\n" + cont
-                else:
-                    text = cont
-            if text:
-                text = f"[{mins}分] " + text
-            row.append(text)
-        rows.append(row)
-        index.append(period)
-    if not rows:
-        return pd.DataFrame()
-    return pd.DataFrame(rows, index=index, columns=DAYS)
+# change_seq（plan_changes の最新連番）を引数に含め、提出・承認があれば作り直す。
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_week_slot_matrix(week: str, change_seq: int):
+    # 教員ごとに最新の週案だけを使う（差戻は除く）
+    cur.execute(
+        """
+        SELECT teacher, grade, class, plan_json
+        FROM weekly_plans
+        WHERE id IN (
+            SELECT MAX(id) FROM weekly_plans
+            WHERE week=? AND status != '差戻'
+            GROUP BY teacher
+        )
+        """,
+        (week,),
+    )
+    return build_slot_matrix(cur.fetchall())
+
+
+# 年度初めから対象週までに承認された週案の累積（45分コマ換算）。
+# 進度の目安（年度経過割合）と同じ時点でそろえて比べるため、hours_total ではなく週案から数える。
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_consumed_until(week: str, change_seq: int) -> dict:
+    cur.execute(
+        """
+        SELECT grade, plan_json
+        FROM weekly_plans
+        WHERE status='承認' AND week >= ? AND week <= ?
+        """,
+        (str(school_year_start(week)), week),
+    )
+    return {k: convert_to_45(m) for k, m in total_week_minutes(cur.fetchall()).items()}
 
 
 # ------------------------------
@@ -563,6 +667,7 @@ if role == "教員":
 # ======================================================
 if role == "管理職":
     require_manager_login()
+    get_job_runner()
 
     st.header("📝 提出された週案一覧（管理職用）")
 
@@ -576,17 +681,9 @@ if role == "管理職":
     )
     all_rows = cur.fetchall()
 
-    # 状態別件数
-    counts = {"提出": 0, "承認": 0, "差戻": 0}
-    for r in all_rows:
-        stt = r[7]
-        if stt in counts:
-            counts[stt] += 1
-
-    st.markdown("#### 状態別件数")
-    st.write(f"- 提出：{counts['提出']} 件")
-    st.write(f"- 承認：{counts['承認']} 件")
-    st.write(f"- 差戻：{counts['差戻']} 件")
+    # 状態別件数・新着（自動更新）
+    init_dashboard_state()
+    live_dashboard()
 
     # フィルタ用の候補
     grade_list = sorted({r[2] for r in all_rows if r[2]})
@@ -627,11 +724,44 @@ if role == "管理職":
     if only_unapproved:
         rows = [r for r in rows if r[7] != "承認"]
 
+    # 一括処理（バックグラウンド実行）
+    with st.expander("⚙ 一括処理（バックグラウンド実行）"):
+        st.caption("※ 表示中（フィルタ適用後）の週案が一括承認・印刷用文書の対象になります。")
+        unapproved_ids = [r[0] for r in rows if r[7] != "承認"]
+        shown_ids = [r[0] for r in rows]
+        col_j1, col_j2 = st.columns(2)
+        with col_j1:
+            if st.button("全校エクスポート（CSV）", key="job_export"):
+                submit_job("export")
+            if st.button("年間累積時数を再計算する", key="job_rebuild_ledger"):
+                submit_job("rebuild_ledger")
+        with col_j2:
+            if st.button(f"表示中の未承認 {len(unapproved_ids)} 件を一括承認", key="job_bulk_approve"):
+                submit_job("bulk_approve", {"ids": unapproved_ids})
+            if st.button(f"表示中の {len(shown_ids)} 件の印刷用文書を作成", key="job_print_documents"):
+                submit_job("print_documents", {"ids": shown_ids})
+        job_monitor()
+
     if not rows:
         st.info("該当する週案はありません。")
     else:
         st.caption("※ 各行をクリックすると詳細が表示されます。")
 
+    # 週を指定したときは、表示中の週案をまとめて 1 つの印刷用 HTML にする
+    if week_filter != "すべて" and rows:
+        if st.checkbox(f"{week_filter} の週案（表示中 {len(rows)} 件）をまとめて印刷用にする"):
+            doc = render_print_html(
+                ((r[0], print_title(r[2], r[3], r[1], r[5]), r[6]) for r in rows),
+                title=f"{week_filter} の週案",
+            )
+            st.download_button(
+                "印刷用 HTML をダウンロード",
+                doc,
+                file_name=f"weekly_plans_{week_filter}.html",
+                mime="text/html",
+            )
+            st.caption("ダウンロードした HTML をブラウザで開き、印刷・PDF 保存してください。")
+
     for (
         wid,
         teacher,
@@ -700,7 +830,7 @@ if role == "管理職":
                 st.write(f"- {s}: {mins} 分")
 
             st.markdown("#### 📄 印刷・PDF保存用レイアウト（この週案）")
-            df_print = build_print_df(timetable)
+            df_print = cached_print_df(wid, plan_json)
             if df_print.empty:
                 st.info("有効なコマがありません。")
             else:
@@ -710,22 +840,11 @@ if role == "管理職":
             col1, col2 = st.columns(2)
             with col1:
                 if st.button(f"✅ 承認する（ID:{wid}）", key=f"approve_{wid}"):
-                    if status != "承認":
-                        for g in week_minutes_all:
-                            for subj, mins in week_minutes_all[g].items():
-                                add_hours(g, subj, mins)
-                        cur.execute(
-                            """
-                            UPDATE weekly_plans
-                            SET status='承認',
-                                approved_at=DATETIME('now'),
-                                approved_by=?
-                            WHERE id=?
-                            """,
-                            ("管理職", wid),
-                        )
-                        conn.commit()
+                    result = approve_plan(conn, wid, week_minutes_all, "管理職")
+                    if result == APPROVED:
                         st.success("承認しました。年間累積時数に反映済みです。")
+                    elif result == HOURS_LOCKED:
+                        st.warning("年間累積時数を更新する一括処理が実行中です。完了してから承認してください。")
                     else:
                         st.info("すでに承認済みです。")
 
@@ -741,6 +860,60 @@ if role == "管理職":
                     else:
                         st.info("すでに差戻済みです。")
 
+    # 週ごとのコマ配置状況
+    st.header("🗓 週ごとのコマ配置状況（全学級 × 曜日・校時）")
+    if not week_list:
+        st.info("まだ提出された週案がありません。")
+    else:
+        col_m1, col_m2 = st.columns(2)
+        with col_m1:
+            matrix_week = st.selectbox("対象週", week_list, key="matrix_week")
+        with col_m2:
+            matrix_grades = st.multiselect("学年で絞り込む（未選択ならすべて）", list(STANDARD_HOURS.keys()), key="matrix_grades")
+
+        change_seq = fetch_latest_change_seq()
+        subjects, counts, class_grades = load_week_slot_matrix(matrix_week, change_seq)
+        if matrix_grades:
+            shown = [c for c in subjects.columns if class_grades.get(c) in matrix_grades]
+            subjects, counts = subjects[shown], counts[shown]
+
+        if subjects.columns.empty:
+            st.info("この週に学級が記録された週案はありません。")
+        else:
+            progress = school_year_progress(matrix_week)
+            consumed = load_consumed_until(matrix_week, change_seq)
+            behind = behind_pace_subjects(consumed, progress)
+            styles = slot_matrix_styles(subjects, counts, class_grades, behind)
+
+            col_s1, col_s2, col_s3 = st.columns(3)
+            col_s1.metric("学級数", len(subjects.columns))
+            col_s2.metric("空きコマ", int((counts == 0).to_numpy().sum()))
+            col_s3.metric("重複割当", int((counts > 1).to_numpy().sum()))
+            st.caption(
+                "灰色：空きコマ／赤：同じコマに異なる教科が割り当てられている学級／"
+                f"橙：{matrix_week} の週までの累積が標準時数の進度（年度経過 {progress:.0%}）に対して遅れている教科"
+            )
+            st.dataframe(
+                subjects.style.apply(lambda _: styles, axis=None),
+                height=min(40 + 35 * len(subjects), 900),
+            )
+
+            shown_grades = sorted({class_grades.get(c) for c in subjects.columns} - {None})
+            behind_rows = [
+                {
+                    "学年": g,
+                    "教科等": subj,
+                    "標準（45分コマ）": STANDARD_HOURS[g][subj],
+                    "目安（45分コマ）": round(STANDARD_HOURS[g][subj] * progress, 1),
+                    "この週までの実施（45分コマ）": round(consumed.get((g, subj), 0.0), 1),
+                }
+                for g, subj in sorted(behind)
+                if g in shown_grades
+            ]
+            if behind_rows:
+                with st.expander(f"進度が遅れている教科（{len(behind_rows)} 件）"):
+                    st.table(behind_rows)
+
     # 年間累積時数一覧
     st.header("📊 年間累積時数の状況（学年×教科／45分コマ換算）")
     for g in STANDARD_HOURS.keys():
@@ -0,0 +1,460 @@
+# ===========================================
+# weekly_plan_core.py
+# 週案アプリの共通定義（Streamlit に依存しない部分）
+# ・学年ごとの標準時数、時間割の枠組み
+# ・学年×教科の分数集計、印刷用レイアウト（DataFrame／HTML）の生成
+# ・週ごとのコマ配置状況（全学級 × 曜日・校時）の集計
+# ・画面（weekly_plan_app.py）と一括処理ワーカー（weekly_plan_jobs.py）の両方から使う
+# ===========================================
+
+import functools
+import html
+import json
+from datetime import date
+
+import pandas as pd
+
+DB_PATH = "weekly_plans.db"
+
+# ------------------------------
+# 学年ごとの標準時数（45分換算コマ数）
+# ------------------------------
+STANDARD_HOURS = {
+    "1年": {
+        "国語": 306,
+        "算数": 140,
+        "生活": 102,
+        "音楽": 68,
+        "図工": 68,
+        "体育": 102,
+        "道徳": 34,
+        "特活": 34,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+    "2年": {
+        "国語": 280,
+        "算数": 140,
+        "生活": 102,
+        "音楽": 68,
+        "図工": 68,
+        "体育": 102,
+        "道徳": 35,
+        "特活": 35,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+    "3年": {
+        "国語": 210,
+        "社会": 70,
+        "算数": 175,
+        "理科": 70,
+        "音楽": 50,
+        "図工": 50,
+        "体育": 105,
+        "道徳": 35,
+        "特活": 35,
+        "外国語活動": 35,
+        "総合的な学習の時間": 70,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+    "4年": {
+        "国語": 175,
+        "社会": 105,
+        "算数": 175,
+        "理科": 105,
+        "音楽": 50,
+        "図工": 50,
+        "体育": 105,
+        "道徳": 35,
+        "特活": 35,
+        "外国語活動": 35,
+        "総合的な学習の時間": 70,
+        "家庭科": 0,
+        "クラブ": 10,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+    "5年": {
+        "国語": 175,
+        "社会": 105,
+        "算数": 175,
+        "理科": 105,
+        "音楽": 45,
+        "図工": 45,
+        "家庭科": 70,
+        "体育": 90,
+        "道徳": 35,
+        "特活": 35,
+        "外国語": 70,
+        "総合的な学習の時間": 70,
+        "クラブ": 10,
+        "委員会": 10,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+    "6年": {
+        "国語": 175,
+        "社会": 105,
+        "算数": 140,
+        "理科": 105,
+        "音楽": 45,
+        "図工": 45,
+        "家庭科": 70,
+        "体育": 90,
+        "道徳": 35,
+        "特活": 35,
+        "外国語": 70,
+        "総合的な学習の時間": 70,
+        "クラブ": 10,
+        "委員会": 10,
+        "学校行事": 0,
+        "読書科": 70,
+        "学校裁量（学力向上）": 35,
+        "学校裁量（探究）": 35,
+    },
+}
+
+
+def get_subjects_for_grade(grade: str):
+    return list(STANDARD_HOURS[grade].keys())
+
+
+# 専科用：全学年の教科リスト（重複なし）
+ALL_SUBJECTS = sorted(
+    {subj for g in STANDARD_HOURS.values() for subj in g.keys()}
+)
+
+# ------------------------------
+# 時間割の枠組み
+# ------------------------------
+DAYS = ["月", "火", "水", "木", "金", "土"]
+PERIODS = ["1校時", "2校時", "3校時", "4校時", "5校時", "学校裁量", "6校時"]
+
+PERIOD_MINUTES = {}
+for day in DAYS:
+    PERIOD_MINUTES[day] = {}
+    for period in PERIODS:
+        if period == "学校裁量":
+            PERIOD_MINUTES[day][period] = 45 if day in ["月", "火", "木", "金"] else 0
+        else:
+            num = int(period[0])
+            PERIOD_MINUTES[day][period] = 40 if num <= 5 else 45
+
+# ------------------------------
+# 分 → 45分コマ換算
+# ------------------------------
+def convert_to_45(mins: float) -> float:
+    return mins / 45
+
+
+# ------------------------------
+# 年間累積時数を加算（commit は呼び出し側で行う）
+# ------------------------------
+def apply_hours(cur, grade: str, subject: str, minutes: float):
+    add_45 = convert_to_45(minutes)
+    cur.execute(
+        "SELECT consumed FROM hours_total WHERE grade=? AND subject=?",
+        (grade, subject),
+    )
+    row = cur.fetchone()
+    if row:
+        new_value = row[0] + add_45
+        cur.execute(
+            "UPDATE hours_total SET consumed=? WHERE grade=? AND subject=?",
+            (new_value, grade, subject),
+        )
+    else:
+        cur.execute(
+            "INSERT INTO hours_total (grade, subject, consumed) VALUES (?, ?, ?)",
+            (grade, subject, add_45),
+        )
+
+
+# ------------------------------
+# 学級名から学年を推定（例：3-1 → 3年）
+# ------------------------------
+def detect_grade_from_class(klass: str):
+    if not klass:
+        return None
+    for ch in klass:
+        if ch.isdigit():
+            g = f"{ch}年"
+            return g if g in STANDARD_HOURS else None
+    return None
+
+
+# ------------------------------
+# 1週間分のコマを学年×教科ごとに分数集計
+# ------------------------------
+def compute_week_subject_minutes(timetable: dict, base_grade: str):
+    """
+    戻り値: { "3年": { "国語": 分数, ... }, "4年": {...}, ... }
+    学級が判別できる場合はそちらを優先し、
+    判別できない場合は base_grade でカウント。
+    """
+    result = {}
+    for day in DAYS:
+        for period in PERIODS:
+            cell = timetable.get(day, {}).get(period)
+            if not cell:
+                continue
+            minutes = PERIOD_MINUTES[day][period]
+            if minutes <= 0:
+                continue
+            subject = cell.get("subject", "")
+            klass = cell.get("class", "")
+            grade_for_slot = detect_grade_from_class(klass) or base_grade
+            if grade_for_slot not in STANDARD_HOURS:
+                continue
+            # その学年でカウント対象の教科だけ集計
+            if subject not in STANDARD_HOURS[grade_for_slot]:
+                continue
+            result.setdefault(grade_for_slot, {})
+            result[grade_for_slot][subject] = (
+                result[grade_for_slot].get(subject, 0) + minutes
+            )
+    return result
+
+
+# ------------------------------
+# 複数の週案をまとめて学年×教科ごとに分数集計
+# ------------------------------
+def total_week_minutes(plans) -> dict:
+    """plans: (基準学年, plan_json) の並び。戻り値: {(学年, 教科): 分数}"""
+    totals = {}
+    for grade, plan_json in plans:
+        timetable = json.loads(plan_json).get("timetable", {})
+        for g, subjects in compute_week_subject_minutes(timetable, grade).items():
+            for subj, mins in subjects.items():
+                totals[(g, subj)] = totals.get((g, subj), 0) + mins
+    return totals
+
+
+# ------------------------------
+# 印刷用レイアウト
+# ------------------------------
+# 印刷に出す校時（どの曜日にも授業がない校時は除く）
+PRINT_PERIODS = [p for p in PERIODS if any(PERIOD_MINUTES[d][p] > 0 for d in DAYS)]
+
+# 週案ごとの印刷レイアウトを保持する件数（LRU）
+PRINT_CACHE_SIZE = 512
+
+
+def print_cell_text(cell: dict, mins: int) -> str:
+    """1 コマ分の印刷用テキスト（例：「[40分] 3-1 国語\n内容」）。"""
+    klass = cell.get("class", "")
+    subj = cell.get("subject", "")
+    cont = cell.get("content", "")
+
+    head = f"{klass} " if klass else ""
+    if subj and subj != "（空欄）":
+        head += subj
+    if cont:
+        text = f"{head}\n{cont}" if head else cont
+    else:
+        text = head
+    return f"[{mins}分] {text}" if text else ""
+
+
+def build_print_rows(timetable: dict):
+    """PRINT_PERIODS の順に、曜日ごとの印刷用テキストを並べた行リストを返す。"""
+    rows = []
+    for period in PRINT_PERIODS:
+        row = []
+        for day in DAYS:
+            mins = PERIOD_MINUTES[day][period]
+            if mins <= 0:
+                row.append("")
+                continue
+            row.append(print_cell_text(timetable.get(day, {}).get(period, {}), mins))
+        rows.append(row)
+    return rows
+
+
+def build_print_df(timetable: dict) -> pd.DataFrame:
+    rows = build_print_rows(timetable)
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows, index=PRINT_PERIODS, columns=DAYS)
+
+
+# 提出済みの週案は書き換えず、再提出は新しい ID になる。
+# plan_json も鍵に含めて、同じ ID で内容が変わった場合は別の版として扱う。
+# 返した DataFrame は共有されるので、呼び出し側で変更しないこと。
+@functools.lru_cache(maxsize=PRINT_CACHE_SIZE)
+def cached_print_df(plan_id: int, plan_json: str) -> pd.DataFrame:
+    return build_print_df(json.loads(plan_json).get("timetable", {}))
+
+
+# ------------------------------
+# 印刷用 HTML（複数の週案をまとめて 1 文書にする）
+# ------------------------------
+PRINT_DOCUMENT_TEMPLATE = (
+    '<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">'
+    "<title>{title}</title>"
+    "<style>"
+    ".plan{{page-break-after:always}}"
+    "table{{border-collapse:collapse;width:100%}}"
+    "td,th{{border:1px solid #999;padding:4px;vertical-align:top;white-space:pre-wrap}}"
+    "</style></head><body>{body}</body></html>"
+)
+PRINT_SECTION_TEMPLATE = '<section class="plan"><h2>{title}</h2>{table}</section>'
+PRINT_TABLE_HEADER = (
+    "<table><thead><tr><th></th>"
+    + "".join(f"<th>{day}</th>" for day in DAYS)
+    + "</tr></thead><tbody>"
+)
+
+
+def print_title(grade: str, klass: str, teacher: str, week: str) -> str:
+    return f"{grade}／{klass or ''}／{teacher}／{week} の週案"
+
+
+@functools.lru_cache(maxsize=PRINT_CACHE_SIZE)
+def cached_print_table_html(plan_id: int, plan_json: str) -> str:
+    rows = build_print_rows(json.loads(plan_json).get("timetable", {}))
+    parts = [PRINT_TABLE_HEADER]
+    for period, row in zip(PRINT_PERIODS, rows):
+        parts.append(f"<tr><th>{period}</th>")
+        parts.extend(f"<td>{html.escape(text)}</td>" for text in row)
+        parts.append("</tr>")
+    parts.append("</tbody></table>")
+    return "".join(parts)
+
+
+def print_section_html(plan_id: int, title: str, plan_json: str) -> str:
+    return PRINT_SECTION_TEMPLATE.format(
+        title=html.escape(title),
+        table=cached_print_table_html(plan_id, plan_json),
+    )
+
+
+def render_print_html(plans, title: str = "週案（印刷用）") -> str:
+    """
+    plans: (plan_id, 見出し, plan_json) の並び。
+    1 つの HTML 文書にまとめて返す（各週案は改ページ区切り）。
+    """
+    body = "".join(
+        print_section_html(plan_id, plan_title, plan_json)
+        for plan_id, plan_title, plan_json in plans
+    )
+    return wrap_print_document(body, title)
+
+
+def wrap_print_document(body: str, title: str = "週案（印刷用）") -> str:
+    return PRINT_DOCUMENT_TEMPLATE.format(title=html.escape(title), body=body)
+
+
+# ------------------------------
+# 週ごとのコマ配置状況（全学級 × 曜日・校時）
+# ------------------------------
+# 授業のある (曜日, 校時) の並び
+WEEK_SLOTS = [(d, p) for d in DAYS for p in PERIODS if PERIOD_MINUTES[d][p] > 0]
+
+# 進度遅れとみなす割合（標準時数 × 年度の経過割合 × この値 未満で遅れ）
+PACE_TOLERANCE = 0.9
+
+
+def school_year_start(week: str) -> date:
+    """対象週が属する年度（4/1〜3/31）の初日。"""
+    d = date.fromisoformat(week)
+    return date(d.year if d.month >= 4 else d.year - 1, 4, 1)
+
+
+def school_year_progress(week: str) -> float:
+    """対象週の時点で年度（4/1〜3/31）がどれだけ経過したかを 0〜1 で返す。"""
+    d = date.fromisoformat(week)
+    start = school_year_start(week)
+    end = date(start.year + 1, 4, 1)
+    return min(max((d - start).days + 7, 0), (end - start).days) / (end - start).days
+
+
+def behind_pace_subjects(consumed: dict, progress: float) -> set:
+    """consumed: {(学年, 教科): 45分コマ累積}。進度が遅れている (学年, 教科) を返す。"""
+    behind = set()
+    for g, subjects in STANDARD_HOURS.items():
+        for subj, std in subjects.items():
+            if std <= 0:
+                continue
+            if consumed.get((g, subj), 0.0) < std * progress * PACE_TOLERANCE:
+                behind.add((g, subj))
+    return behind
+
+
+def build_slot_matrix(plans):
+    """
+    plans: (教員, 基準学年, 学級, plan_json) の並び（同じ週の週案）。
+    戻り値: (教科の表, 異なる教科の数の表, {学級: 学年})
+      表はどちらも 行 = (曜日, 校時)、列 = 学級。行はその週にいずれかの週案で使ったコマだけ。
+    """
+    records = []
+    class_grades = {}
+    for teacher, grade, class_name, plan_json in plans:
+        if class_name:
+            class_grades.setdefault(class_name, detect_grade_from_class(class_name) or grade)
+        timetable = json.loads(plan_json).get("timetable", {})
+        for day, period in WEEK_SLOTS:
+            cell = timetable.get(day, {}).get(period)
+            if not cell:
+                continue
+            subj = cell.get("subject", "")
+            if not subj or subj == "（空欄）":
+                continue
+            klass = cell.get("class", "") or class_name
+            if not klass:
+                continue
+            class_grades.setdefault(klass, detect_grade_from_class(klass) or grade)
+            records.append((day, period, klass, subj, teacher))
+
+    # どの週案でも使っていないコマ（授業のない土曜など）は行に含めない。
+    # 含めると全学級ぶんの空きコマとして数え、灰色に塗ってしまう
+    used = {(day, period) for day, period, *_ in records}
+    index = pd.MultiIndex.from_tuples(
+        [slot for slot in WEEK_SLOTS if slot in used], names=["曜日", "校時"]
+    )
+    classes = sorted(class_grades, key=lambda c: (class_grades[c] or "", c))
+    if not records:
+        empty = pd.DataFrame("", index=index, columns=classes)
+        return empty, pd.DataFrame(0, index=index, columns=classes), class_grades
+
+    df = pd.DataFrame(records, columns=["曜日", "校時", "学級", "教科等", "教員"])
+    # 担任と専科が同じ授業（同じ学級・コマ・教科）を記入した場合は 1 つの授業として数える
+    df = df.drop_duplicates(["曜日", "校時", "学級", "教科等"])
+    grouped = df.groupby(["曜日", "校時", "学級"])["教科等"]
+    subjects = grouped.agg("／".join).unstack("学級")
+    counts = grouped.size().unstack("学級")
+    subjects = subjects.reindex(index=index, columns=classes).fillna("")
+    counts = counts.reindex(index=index, columns=classes).fillna(0).astype(int)
+    return subjects, counts, class_grades
+
+
+SLOT_STYLE_EMPTY = "background-color: #f2f2f2"
+SLOT_STYLE_OVER = "background-color: #f5b7b1; font-weight: bold"
+SLOT_STYLE_BEHIND = "background-color: #fde2b8"
+
+
+def slot_matrix_styles(subjects: pd.DataFrame, counts: pd.DataFrame, class_grades: dict, behind: set) -> pd.DataFrame:
+    """Styler.apply(axis=None) 用の CSS 表（空きコマ／重複割当／進度遅れの教科）。"""
+    styles = pd.DataFrame("", index=subjects.index, columns=subjects.columns)
+    styles = styles.mask(counts == 0, SLOT_STYLE_EMPTY)
+    if behind:
+        for klass in subjects.columns:
+            g = class_grades.get(klass)
+            behind_here = {subj for bg, subj in behind if bg == g}
+            if behind_here:
+                hit = subjects[klass].isin(behind_here) & (counts[klass] == 1)
+                styles.loc[hit, klass] = SLOT_STYLE_BEHIND
+    styles = styles.mask(counts > 1, SLOT_STYLE_OVER)
+    return styles
@@ -0,0 +1,566 @@
+# ===========================================
+# weekly_plan_jobs.py
+# 一括処理のバックグラウンド実行（ローカルジョブキュー）
+# ・jobs テーブルに依頼・進捗・結果を記録
+# ・実処理は別プロセス（python -m weekly_plan_jobs）で実行し、画面（リクエスト）を止めない
+# ・キャンセル要求はジョブ側が区切りごとに確認して中断
+# ・hours_total を更新する処理は同時に 1 件だけ実行（ロックキー）
+# ===========================================
+
+import csv
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from weekly_plan_core import (
+    DB_PATH,
+    STANDARD_HOURS,
+    apply_hours,
+    compute_week_subject_minutes,
+    print_section_html,
+    print_title,
+    total_week_minutes,
+    wrap_print_document,
+)
+
+EXPORT_DIR = "exports"
+
+# hours_total を更新するジョブが共有するロックキー
+HOURS_LOCK = "hours_total"
+
+# ジョブ種別 → 表示名
+JOB_LABELS = {
+    "export": "全校エクスポート（CSV）",
+    "rebuild_ledger": "年間累積時数の再計算",
+    "bulk_approve": "一括承認",
+    "print_documents": "印刷用文書の一括作成",
+}
+
+# ジョブ種別 → ロックキー（None はロック不要）
+JOB_LOCKS = {
+    "export": None,
+    "rebuild_ledger": HOURS_LOCK,
+    "bulk_approve": HOURS_LOCK,
+    "print_documents": None,
+}
+
+JOB_STATUS_LABELS = {
+    "queued": "待機中",
+    "running": "実行中",
+    "done": "完了",
+    "error": "エラー",
+    "cancelled": "中止",
+}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobLockedError(Exception):
+    """同じロックキーのジョブが待機中・実行中のときに送出する。"""
+
+
+class JobStartError(Exception):
+    """ジョブを登録したもののワーカーに渡せなかったときに送出する（jobs 側は error にしてある）。"""
+
+
+class JobCancelled(Exception):
+    """キャンセル要求を受けてジョブを中断するときに送出する。"""
+
+
+# ------------------------------
+# jobs テーブル
+# ------------------------------
+def init_jobs_table(conn: sqlite3.Connection):
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        params_json TEXT,
+        lock_key TEXT,
+        status TEXT,
+        progress_done INTEGER DEFAULT 0,
+        progress_total INTEGER DEFAULT 0,
+        message TEXT,
+        result_path TEXT,
+        cancel_requested INTEGER DEFAULT 0,
+        requested_by TEXT,
+        created_at TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        runner_pid INTEGER,
+        worker_pid INTEGER
+    )
+    """
+    )
+    # 既存テーブルに不足列があれば追加（古いDBからの移行用）
+    for col in ["runner_pid", "worker_pid"]:
+        try:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} INTEGER")
+        except sqlite3.OperationalError:
+            pass
+    conn.commit()
+
+
+def pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_locked(conn: sqlite3.Connection, lock_key: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM jobs WHERE lock_key=? AND status IN (?, ?) LIMIT 1",
+        (lock_key, *ACTIVE_STATUSES),
+    ).fetchone()
+    return row is not None
+
+
+def list_jobs(conn: sqlite3.Connection, limit: int = 20):
+    cur = conn.execute(
+        """
+        SELECT id, kind, status, progress_done, progress_total, message,
+               result_path, cancel_requested, created_at, finished_at
+        FROM jobs
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+# ------------------------------
+# 週案の承認（年間累積時数への反映を伴う）
+# ------------------------------
+APPROVED = "approved"
+ALREADY_APPROVED = "already"
+HOURS_LOCKED = "locked"
+
+
+def approve_plan(
+    conn: sqlite3.Connection,
+    wid: int,
+    week_minutes_all: dict,
+    approver: str = "管理職",
+    check_lock: bool = True,
+) -> str:
+    """
+    ロック確認・状態更新・累積時数の加算を 1 つの BEGIN IMMEDIATE で行う。
+    戻り値: APPROVED／ALREADY_APPROVED（承認済み）／HOURS_LOCKED（再計算などが実行中）
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if check_lock and is_locked(conn, HOURS_LOCK):
+            conn.rollback()
+            return HOURS_LOCKED
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE weekly_plans
+            SET status='承認',
+                approved_at=DATETIME('now'),
+                approved_by=?
+            WHERE id=? AND status!='承認'
+            """,
+            (approver, wid),
+        )
+        if cur.rowcount == 0:
+            conn.rollback()
+            return ALREADY_APPROVED
+        for g, subjects in week_minutes_all.items():
+            for subj, mins in subjects.items():
+                apply_hours(cur, g, subj, mins)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return APPROVED
+
+
+# ------------------------------
+# ジョブ実行中の進捗報告・キャンセル確認
+# ------------------------------
+class JobContext:
+    def __init__(self, conn: sqlite3.Connection, job_id: int):
+        self.conn = conn
+        self.job_id = job_id
+
+    def report(self, done: int, total: int, message: str = ""):
+        self.conn.execute(
+            "UPDATE jobs SET progress_done=?, progress_total=?, message=? WHERE id=?",
+            (done, total, message, self.job_id),
+        )
+        self.conn.commit()
+
+    def check_cancel(self):
+        row = self.conn.execute(
+            "SELECT cancel_requested FROM jobs WHERE id=?", (self.job_id,)
+        ).fetchone()
+        if row and row[0]:
+            raise JobCancelled()
+
+
+def _fetch_plans(conn: sqlite3.Connection, ids=None, status=None):
+    sql = """
+        SELECT id, teacher, grade, class, teacher_type, week,
+               plan_json, status, submitted_at, approved_at, approved_by
+        FROM weekly_plans
+    """
+    where = []
+    args = []
+    if ids is not None:
+        if not ids:
+            return []
+        where.append(f"id IN ({','.join('?' for _ in ids)})")
+        args.extend(ids)
+    if status is not None:
+        where.append("status=?")
+        args.append(status)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY week, grade, class, id"
+    return conn.execute(sql, args).fetchall()
+
+
+def _result_path(job_id: int, suffix: str) -> str:
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return os.path.join(EXPORT_DIR, f"job_{job_id}{suffix}")
+
+
+# ------------------------------
+# 各ジョブの本体
+# ------------------------------
+def job_export(ctx: JobContext, params: dict) -> str:
+    """全週案を学年×教科の分数つきで CSV に書き出す（Excel 向けに BOM 付き）。"""
+    plans = _fetch_plans(ctx.conn)
+    path = _result_path(ctx.job_id, ".csv")
+    total = len(plans)
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [
+                "ID", "週", "教員", "勤務形態", "基準学年", "学級", "状態",
+                "提出日時", "承認日時", "承認者", "集計学年", "教科等", "分数",
+            ]
+        )
+        for i, r in enumerate(plans, start=1):
+            (wid, teacher, grade, klass, teacher_type, week, plan_json,
+             status, submitted_at, approved_at, approved_by) = r
+            timetable = json.loads(plan_json).get("timetable", {})
+            base = [
+                wid, week, teacher, teacher_type, grade, klass, status,
+                submitted_at, approved_at, approved_by,
+            ]
+            week_minutes_all = compute_week_subject_minutes(timetable, grade)
+            if not week_minutes_all:
+                writer.writerow(base + ["", "", 0])
+            for g, subjects in week_minutes_all.items():
+                for subj, mins in subjects.items():
+                    writer.writerow(base + [g, subj, mins])
+            if i % 20 == 0 or i == total:
+                ctx.check_cancel()
+                ctx.report(i, total, f"{i}/{total} 件を書き出しました")
+    return path
+
+
+def job_rebuild_ledger(ctx: JobContext, params: dict) -> str:
+    """
+    承認済みの週案から hours_total を作り直す。
+    読み出しから書き込みまでを 1 つの BEGIN IMMEDIATE で行い、途中の承認を取りこぼさない。
+    """
+    ctx.check_cancel()
+    ctx.report(0, 0, "集計・書き込み中")
+    conn = ctx.conn
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        plans = _fetch_plans(conn, status="承認")
+        totals = total_week_minutes((r[2], r[6]) for r in plans)
+
+        cur = conn.cursor()
+        cur.execute("DELETE FROM hours_total")
+        for (g, subj), mins in totals.items():
+            if subj in STANDARD_HOURS.get(g, {}):
+                apply_hours(cur, g, subj, mins)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    ctx.report(len(plans), len(plans), f"{len(plans)} 件から再計算しました")
+    return ""
+
+
+def job_bulk_approve(ctx: JobContext, params: dict) -> str:
+    """指定 ID のうち未承認の週案を 1 件ずつ承認し、年間累積時数に反映する。"""
+    ids = params.get("ids", [])
+    approver = params.get("approved_by", "管理職")
+    plans = [r for r in _fetch_plans(ctx.conn, ids=ids) if r[7] != "承認"]
+    total = len(plans)
+    ctx.report(0, total)
+    for i, r in enumerate(plans, start=1):
+        ctx.check_cancel()
+        wid, grade, plan_json = r[0], r[2], r[6]
+        timetable = json.loads(plan_json).get("timetable", {})
+        # このジョブ自身が HOURS_LOCK を持っているのでロック確認はしない
+        approve_plan(
+            ctx.conn,
+            wid,
+            compute_week_subject_minutes(timetable, grade),
+            approver,
+            check_lock=False,
+        )
+        ctx.report(i, total, f"{i}/{total} 件を処理しました")
+    return ""
+
+
+def job_print_documents(ctx: JobContext, params: dict) -> str:
+    """指定 ID の週案を印刷用レイアウトにして 1 つの HTML にまとめる。"""
+    plans = _fetch_plans(ctx.conn, ids=params.get("ids", []))
+    path = _result_path(ctx.job_id, ".html")
+    total = len(plans)
+    parts = []
+    for i, r in enumerate(plans, start=1):
+        wid, teacher, grade, klass, week, plan_json = r[0], r[1], r[2], r[3], r[5], r[6]
+        parts.append(print_section_html(wid, print_title(grade, klass, teacher, week), plan_json))
+        if i % 20 == 0 or i == total:
+            ctx.check_cancel()
+            ctx.report(i, total, f"{i}/{total} 件を作成しました")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(wrap_print_document("".join(parts)))
+    return path
+
+
+JOB_FUNCTIONS = {
+    "export": job_export,
+    "rebuild_ledger": job_rebuild_ledger,
+    "bulk_approve": job_bulk_approve,
+    "print_documents": job_print_documents,
+}
+
+
+# ------------------------------
+# ワーカープロセス側の入口
+# ------------------------------
+def run_job(db_path: str, job_id: int):
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        row = conn.execute(
+            "SELECT kind, params_json, cancel_requested FROM jobs WHERE id=?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return
+        kind, params_json, cancel_requested = row
+        if cancel_requested:
+            conn.execute(
+                "UPDATE jobs SET status='cancelled', finished_at=DATETIME('now') WHERE id=?",
+                (job_id,),
+            )
+            conn.commit()
+            return
+        conn.execute(
+            "UPDATE jobs SET status='running', worker_pid=?, started_at=DATETIME('now') "
+            "WHERE id=?",
+            (os.getpid(), job_id),
+        )
+        conn.commit()
+
+        ctx = JobContext(conn, job_id)
+        try:
+            result_path = JOB_FUNCTIONS[kind](ctx, json.loads(params_json or "{}"))
+        except JobCancelled:
+            conn.rollback()
+            conn.execute(
+                "UPDATE jobs SET status='cancelled', message='中止しました', "
+                "finished_at=DATETIME('now') WHERE id=?",
+                (job_id,),
+            )
+        except Exception as e:
+            conn.rollback()
+            conn.execute(
+                "UPDATE jobs SET status='error', message=?, "
+                "finished_at=DATETIME('now') WHERE id=?",
+                (f"{type(e).__name__}: {e}", job_id),
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status='done', result_path=?, "
+                "finished_at=DATETIME('now') WHERE id=?",
+                (result_path or None, job_id),
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ------------------------------
+# 画面側から使うジョブランナー
+# ------------------------------
+class JobRunner:
+    """
+    Streamlit のサーバープロセスにつき 1 つだけ作る（st.cache_resource で保持）。
+    ワーカーは `python -m weekly_plan_jobs <db> <job_id>` の別プロセスとして起動する。
+    多スレッドの Streamlit プロセスから fork すると、ロックや SQLite の接続を
+    引き継いだまま止まるおそれがあるため。同時実行数はスレッドプールで抑える。
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_workers: int = 2):
+        # ワーカーは同じ作業ディレクトリで起動するが、念のため絶対パスで渡す
+        self.db_path = os.path.abspath(db_path)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        init_jobs_table(self.conn)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="weekly-plan-job"
+        )
+        self.futures = {}
+        # self.conn は全セッションで共有するため、submit／cancel の間は他の操作を入れない
+        self.lock = threading.Lock()
+        self.reap_orphans()
+
+    def reap_orphans(self):
+        """
+        前回のサーバー停止で取り残されたジョブを error にし、ロックを解放する。
+        登録したランナーのプロセスも実行中のワーカーも残っていないものだけが対象。
+        キャッシュのクリアで作り直した場合、同じプロセスの旧ランナーのジョブは
+        まだ動いているので触らない。
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, runner_pid, worker_pid FROM jobs WHERE status IN (?, ?)",
+                ACTIVE_STATUSES,
+            ).fetchall()
+            orphans = [
+                (job_id, *ACTIVE_STATUSES)
+                for job_id, runner_pid, worker_pid in rows
+                if runner_pid != os.getpid()
+                and not pid_alive(runner_pid)
+                and not pid_alive(worker_pid)
+            ]
+            self.conn.executemany(
+                "UPDATE jobs SET status='error', message='サーバー再起動により中断', "
+                "finished_at=DATETIME('now') WHERE id=? AND status IN (?, ?)",
+                orphans,
+            )
+            self.conn.commit()
+
+    def shutdown(self):
+        """
+        st.cache_resource から外されたときに呼ぶ。新しいジョブは受け付けず、
+        受付済みのジョブは最後まで実行させる（完了の記録はコールバックが行う）。
+        """
+        self.executor.shutdown(wait=False)
+
+    def _worker_command(self, job_id: int) -> list:
+        return [sys.executable, "-m", "weekly_plan_jobs", self.db_path, str(job_id)]
+
+    def _worker_env(self) -> dict:
+        # 作業ディレクトリ以外から起動されていても本モジュールを import できるようにする
+        env = dict(os.environ)
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        env["PYTHONPATH"] = os.pathsep.join(
+            p for p in (module_dir, env.get("PYTHONPATH")) if p
+        )
+        return env
+
+    def _launch(self, job_id: int) -> int:
+        """スレッドプール上で 1 件分のワーカープロセスを起動し、終了を待つ。"""
+        proc = subprocess.run(self._worker_command(job_id), env=self._worker_env())
+        return proc.returncode
+
+    def submit(self, kind: str, params: dict = None, requested_by: str = "管理職") -> int:
+        lock_key = JOB_LOCKS[kind]
+        with self.lock:
+            # 空きの確認と登録を 1 つのトランザクションで行い、二重起動を防ぐ
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if lock_key and is_locked(self.conn, lock_key):
+                    raise JobLockedError(lock_key)
+                cur = self.conn.execute(
+                    """
+                    INSERT INTO jobs
+                      (kind, params_json, lock_key, status, requested_by, created_at, runner_pid)
+                    VALUES
+                      (?, ?, ?, 'queued', ?, DATETIME('now'), ?)
+                    """,
+                    (
+                        kind,
+                        json.dumps(params or {}, ensure_ascii=False),
+                        lock_key,
+                        requested_by,
+                        os.getpid(),
+                    ),
+                )
+                job_id = cur.lastrowid
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            try:
+                future = self.executor.submit(self._launch, job_id)
+            except Exception as e:
+                # queued のまま残すとロックも解放されないので、ここで error にする
+                self._finish_orphan(job_id, f"ワーカーに渡せませんでした（{type(e).__name__}: {e}）")
+                raise JobStartError(job_id) from e
+            self.futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_worker_exit(job_id, f))
+        return job_id
+
+    def _finish_orphan(self, job_id: int, message: str):
+        """
+        ワーカーが結果を書けずに終わったジョブを error にする。
+        完了・中止などワーカー自身が書いた結果は上書きしない。
+        コールバックのスレッドからも呼ぶため、self.conn ではなく専用の接続を使う。
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute(
+                "UPDATE jobs SET status='error', message=?, finished_at=DATETIME('now') "
+                "WHERE id=? AND status IN (?, ?)",
+                (message, job_id, *ACTIVE_STATUSES),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _on_worker_exit(self, job_id: int, future):
+        self.futures.pop(job_id, None)
+        if future.cancelled():
+            # 待機中のキャンセルは cancel() 側で中止扱いにしている
+            return
+        error = future.exception()
+        if error is not None:
+            message = f"ワーカーを起動できませんでした（{type(error).__name__}: {error}）"
+        elif future.result() != 0:
+            message = f"ワーカーが異常終了しました（終了コード {future.result()}）"
+        else:
+            message = "ワーカーが結果を記録せずに終了しました"
+        self._finish_orphan(job_id, message)
+
+    def cancel(self, job_id: int):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET cancel_requested=1 WHERE id=?", (job_id,))
+            future = self.futures.get(job_id)
+            if future is not None and future.cancel():
+                # まだワーカーに渡っていなければその場で中止扱いにする
+                self.conn.execute(
+                    "UPDATE jobs SET status='cancelled', message='中止しました', "
+                    "finished_at=DATETIME('now') WHERE id=? AND status='queued'",
+                    (job_id,),
+                )
+            self.conn.commit()
+
+
+if __name__ == "__main__":
+    # JobRunner から `python -m weekly_plan_jobs <db_path> <job_id>` で起動される
+    run_job(sys.argv[1], int(sys.argv[2]))